@@ -62,6 +62,88 @@ def get_forces(
     return force_avg
 
 
+def get_ensemble(
+    struc, nstep, nmodel, calculator, E_ref, al_type, forces_buf=None, energy_buf=None
+):
+    """Function [get_ensemble]
+    Evaluate predicted energies and forces of all different trained models
+    and stack them along the first (ensemble) axis.
+
+    Parameters:
+
+    struc: ASE atoms
+        A structral configuration at the current step
+    nstep: int
+        The number of subsampling sets
+    nmodel: int
+        The number of ensemble model sets with different initialization
+    calculator: list of ASE calculators
+        Calculators from trained models
+    E_ref: list of np.array of float
+        The energies of reference state (Here, ground state)
+    al_type: str
+        Type of active learning: 'energy', 'force', 'force_max'
+    forces_buf: np.array of float (optional)
+        Preallocated buffer of predicted forces
+    energy_buf: np.array of float (optional)
+        Preallocated buffer of predicted energies
+
+    Returns:
+
+    energy_buf: np.array of float
+        Predicted (atomic energies for 'energy_max') energies shifted by E_ref
+        with a shape of (nmodel*nstep,) or (nmodel*nstep, natoms)
+    forces_buf: np.array of float
+        Predicted forces with a shape of (nmodel*nstep, natoms, 3)
+    """
+
+    if forces_buf is None or energy_buf is None:
+        forces_buf, energy_buf = get_forces_buf(len(struc), nstep, nmodel, al_type)
+
+    for zndex in range(nmodel * nstep):
+        struc.calc = calculator[zndex]
+        forces_buf[zndex] = struc.get_forces()
+        if al_type == 'energy_max':
+            energy_buf[zndex] = struc.get_potential_energies() - E_ref[1][zndex]
+        else:
+            energy_buf[zndex] = struc.get_potential_energy() - E_ref[0][zndex]
+
+    return energy_buf, forces_buf
+
+
+def get_forces_buf(natoms, nstep, nmodel, al_type):
+    """Function [get_forces_buf]
+    Allocate the buffers of predicted forces and energies
+    from all different trained models.
+
+    Parameters:
+
+    natoms: int
+        The number of atoms in the simulation cell
+    nstep: int
+        The number of subsampling sets
+    nmodel: int
+        The number of ensemble model sets with different initialization
+    al_type: str
+        Type of active learning: 'energy', 'force', 'force_max'
+
+    Returns:
+
+    forces_buf: np.array of float
+        Buffer of predicted forces
+    energy_buf: np.array of float
+        Buffer of predicted energies
+    """
+
+    forces_buf = np.empty((nmodel * nstep, natoms, 3))
+    if al_type == 'energy_max':
+        energy_buf = np.empty((nmodel * nstep, natoms))
+    else:
+        energy_buf = np.empty(nmodel * nstep)
+
+    return forces_buf, energy_buf
+
+
 def get_stress(
     struc, nstep, nmodel, calculator
 ):
@@ -110,7 +192,7 @@ def get_stress(
 
 
 def get_MDinfo_temp(
-    struc, nstep, nmodel, calculator, harmonic_F, E_ref, signal_P = False
+    struc, nstep, nmodel, calculator, harmonic_F, E_ref, signal_P = False, Epot = None
 ):
     """Function [get_MDinfo_temp]
     Extract the average of total, potential, and kinetic energy of
@@ -126,6 +208,10 @@ def get_MDinfo_temp(
         The number of ensemble model sets with different initialization
     calculator: ASE calculator or list of ASE calculators
         Calculators from trained models
+    Epot: np.array of float (optional)
+        Predicted potential energies shifted by E_ref
+        already evaluated at the current step (e.g. from get_ensemble).
+        If given, trained models are not evaluated again.
 
     Returns:
 
@@ -144,20 +230,28 @@ def get_MDinfo_temp(
     if signal_P:
         info_P = []
 
-    zndex = 0
-    for index_nmodel in range(nmodel):
-        for index_nstep in range(nstep):
-            struc.calc = calculator[zndex]
-            PE = struc.get_potential_energy() - E_ref[0][zndex]
-            KE = struc.get_kinetic_energy()
-            TE = PE + KE
-            info_TE.append(TE)
-            info_PE.append(PE)
-            info_KE.append(KE)
-            info_T.append(struc.get_temperature())
-            if signal_P:
-                info_P.append(struc.get_stress())
-            zndex += 1
+    if Epot is not None and not signal_P:
+        # Reuse predicted potential energies;
+        # kinetic energy and temperature do not depend on the models
+        info_PE = Epot
+        info_KE = struc.get_kinetic_energy()
+        info_T = struc.get_temperature()
+        info_TE = Epot + info_KE
+    else:
+        zndex = 0
+        for index_nmodel in range(nmodel):
+            for index_nstep in range(nstep):
+                struc.calc = calculator[zndex]
+                PE = struc.get_potential_energy() - E_ref[0][zndex]
+                KE = struc.get_kinetic_energy()
+                TE = PE + KE
+                info_TE.append(TE)
+                info_PE.append(PE)
+                info_KE.append(KE)
+                info_T.append(struc.get_temperature())
+                if signal_P:
+                    info_P.append(struc.get_stress())
+                zndex += 1
     
     # Get their average
     # info_TE_avg =\
@@ -1,28 +1,24 @@
 from ase.io.trajectory import Trajectory
 from ase.io.trajectory import TrajectoryWriter
 import ase.units as units
-from ase.io.cif        import write_cif
 
 import time
 import os
+import sys
+import math
 import random
 import numpy as np
-import pandas as pd
-from decimal import Decimal
-from ase.build import make_supercell
-from ase.io import read as atoms_read
-from ase.md.velocitydistribution import MaxwellBoltzmannDistribution
+from numba import njit
 
 from libs.lib_util    import single_print
-from libs.lib_MD_util import get_forces, get_MDinfo_temp, get_masses
+from libs.lib_MD_util import get_MDinfo_temp, get_masses, get_ensemble, get_forces_buf
 from libs.lib_criteria import eval_uncert, uncert_strconvter, get_criteria, get_criteria_prob
 
-import torch
-torch.set_default_dtype(torch.float64)
 
 def cont_NVTLangevin_temp(
     inputs, struc, timestep, temperature, calculator, E_ref,
     MD_index, MD_step_index, signal_uncert=False, signal_append=True, fix_com=True,
+    nrandom_bytes=8*1024**2
 ):
     """Function [NVTLangevin]
     Evalulate the absolute and relative uncertainties of
@@ -67,6 +63,11 @@ def cont_NVTLangevin_temp(
     fixcm: bool (optional)
         If True, the position and momentum of the center of mass is
         kept unperturbed.  Default: True.
+    nrandom_bytes: int (optional)
+        Memory budget in bytes of the random numbers sampled at once.
+        The number of MD steps per batch is this budget divided by
+        the size of xi and eta at one step (natoms*3*8*2 bytes).
+        Default: 8 MiB.
     """
 
     time_init = time.time()
@@ -122,22 +123,17 @@ def cont_NVTLangevin_temp(
             # Log MD information at the current step in the log file
             file_log = open(logfile, 'a')
             file_log.write(
-                '{:.5f}'.format(Decimal(str(0.0))) + '   \t' +
-                '{:.5e}'.format(Decimal(str(info_TE))) + '\t' +
-                '{:.5e}'.format(Decimal(str(info_PE))) + '\t' +
-                '{:.5e}'.format(Decimal(str(info_KE))) + '\t' +
-                '{:.2f}'.format(Decimal(str(info_T)))
+                f'{0.0:.5f}   \t{info_TE:.5e}\t{info_PE:.5e}\t{info_KE:.5e}\t{info_T:.2f}'
                 )
             if signal_uncert:
                 file_log.write(
-                    '      \t' +
-                    uncert_strconvter(uncerts.UncertAbs_E) + '\t' +
-                    uncert_strconvter(uncerts.UncertRel_E) + '\t' +
-                    uncert_strconvter(uncerts.UncertAbs_F) + '\t' +
-                    uncert_strconvter(uncerts.UncertRel_F) + '\t' +
-                    uncert_strconvter(uncerts.UncertAbs_S) + '\t' +
-                    uncert_strconvter(uncerts.UncertRel_S) + '\t' +
-                    uncert_strconvter(S_step) + '\n'
+                    f'      \t{uncert_strconvter(uncerts.UncertAbs_E)}'
+                    f'\t{uncert_strconvter(uncerts.UncertRel_E)}'
+                    f'\t{uncert_strconvter(uncerts.UncertAbs_F)}'
+                    f'\t{uncert_strconvter(uncerts.UncertRel_F)}'
+                    f'\t{uncert_strconvter(uncerts.UncertAbs_S)}'
+                    f'\t{uncert_strconvter(uncerts.UncertRel_S)}'
+                    f'\t{uncert_strconvter(S_step)}\n'
                     )
             else:
                 file_log.write('\n')
@@ -145,205 +141,449 @@ def cont_NVTLangevin_temp(
     else:
         file_traj = TrajectoryWriter(filename=trajectory, mode='a')
 
-    write_traj = TrajectoryWriter(
-        filename=f'TRAJ/traj-{condition}_{inputs.index+1}.traj',
-        mode='a'
+    # Select the uncertainty criteria for heating the atom idx_atom
+    if inputs.al_type == 'force_max':
+        uncert_avg = criteria_collected.Un_Abs_F_avg_i
+        uncert_std = criteria_collected.Un_Abs_F_std_i
+    elif inputs.al_type == 'energy_max':
+        uncert_avg = criteria_collected.Un_Abs_E_avg_i
+        uncert_std = criteria_collected.Un_Abs_E_std_i
+    else:
+        sys.exit("NVTLangevin_temp requires al_type of 'force_max' or 'energy_max'.")
+
+    # Get essential properties
+    # (Atoms are fixed during MD, so are masses and Langevin coefficients)
+    natoms = len(struc)
+    masses = get_masses(struc.get_masses(), natoms)
+    temp_factor_kB = inputs.temp_factor * units.kB
+
+    # Select the backend of the Langevin integrator
+    if inputs.integrator_backend == 'numba':
+        langevin_step, langevin_halfstep = _langevin_step, _langevin_halfstep
+    elif inputs.integrator_backend == 'numpy':
+        langevin_step, langevin_halfstep = _langevin_step_numpy, _langevin_halfstep_numpy
+    else:
+        sys.exit("integrator_backend should be 'numba' or 'numpy'.")
+
+    # Scratch arrays for random changes of positions and velocities
+    rnd_pos = np.empty((natoms, 3))
+    rnd_vel = np.empty((natoms, 3))
+
+    # Specialize the integrator steps on the fixed MD settings
+    step_fn, halfstep_fn = _make_langevin_step(
+        langevin_step, langevin_halfstep, masses, timestep, inputs.friction,
+        temperature, temp_factor_kB, inputs.idx_atom, fix_com, rnd_pos, rnd_vel
         )
 
+    # Without heating (temp_factor = 0), the uncertainty of each step is not needed
+    # and the heated atom keeps the base coefficients
+    want_std = inputs.temp_factor > 0
+    temp_ratio = None
+
+    # Precision of the force uncertainty reduction
+    if inputs.uncert_dtype == 'fp64':
+        uncert_dtype = np.float64
+    elif inputs.uncert_dtype == 'fp32':
+        uncert_dtype = np.float32
+    else:
+        sys.exit("uncert_dtype should be 'fp64' or 'fp32'.")
+
+    # Reuse the buffers of predicted forces and energies across MD steps
+    forces_buf, energy_buf = get_forces_buf(natoms, inputs.nstep, inputs.nmodel, inputs.al_type)
+    diff_buf = np.empty(forces_buf.shape, dtype=uncert_dtype)
+
     # Get averaged force from trained models
-    forces, step_std = get_forces_temp(struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, inputs.anharmonic_F, criteria_collected, inputs.al_type, E_ref)
-
-    # mpi_print(f'Step 3: {time.time()-time_init}', rank)
-    # Go trough steps until the requested number of steps
-    # If appending, it starts from Langevin_idx. Otherwise, Langevin_idx = 0
-    while (MD_index < inputs.ntotal) or (inputs.calc_type == 'period' and MD_step_index < inputs.nperiod*inputs.loginterval):
-
-        accept = '--         '
-        natoms = len(struc)
-
-        # mpi_print(f'Step 6: {time.time()-time_init}', rank)
-        # Get averaged forces and velocities
-        if forces is None:
-            forces, step_std = get_forces_temp(struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, inputs.anharmonic_F, criteria_collected, inputs.al_type, E_ref)
-        # Velocity is already calculated based on averaged forces
-        # in the previous step
-        velocity = struc.get_velocities()
-        
-        # mpi_print(f'Step 7: {time.time()-time_init}', rank)
-        # Sample the random numbers for the temperature fluctuation
-        # xi = np.empty(shape=(natoms, 3))
-        # eta = np.empty(shape=(natoms, 3))
-        xi = np.random.standard_normal(size=(natoms, 3))
-        eta = np.random.standard_normal(size=(natoms, 3))
-
-        # mpi_print(f'Step 4: {time.time()-time_init}', rank)
-        # Get essential properties
-        masses = get_masses(struc.get_masses(), natoms)
-
-        # mpi_print(f'Step 5: {time.time()-time_init}', rank)
-        # Get Langevin coefficients
-        sigma = np.sqrt(2 * temperature * inputs.friction / masses)
-        c1 = timestep / 2. - timestep * timestep * inputs.friction / 8.
-        c2 = timestep * inputs.friction / 2 - timestep * timestep * inputs.friction * inputs.friction / 8.
-        c3 = np.sqrt(timestep) * sigma / 2. - timestep**1.5 * inputs.friction * sigma / 8.
-        c5 = timestep**1.5 * sigma / (2 * np.sqrt(3))
-        c4 = inputs.friction / 2. * c5
-
-        if inputs.al_type == 'force_max':
-            uncert_ratio = (step_std[inputs.idx_atom] - criteria_collected.Un_Abs_F_avg_i) / (criteria_collected.Un_Abs_F_std_i)
-            if step_std[inputs.idx_atom] - criteria_collected.Un_Abs_F_avg_i < 0:
-                temp_ratio = 1.0
-            else:
-                temp_ratio = np.exp( (-1/2) * (uncert_ratio)**2 )
-        elif inputs.al_type == 'energy_max':
-            uncert_ratio = (step_std[inputs.idx_atom] - criteria_collected.Un_Abs_E_avg_i) / (criteria_collected.Un_Abs_E_std_i)
-            if step_std[inputs.idx_atom] - criteria_collected.Un_Abs_E_avg_i < 0:
-                temp_ratio = 1.0
-            else:
-                temp_ratio = np.exp( (-1/2) * (uncert_ratio)**2 )
-
-        single_print(f'Step {MD_step_index}; temp activate (atom {inputs.idx_atom}):{temp_ratio}')
-        sigma_elem = np.sqrt(2 * (temperature + temp_ratio * (inputs.temp_factor * units.kB)) * inputs.friction / masses[inputs.idx_atom][0])
-        c3_elem = np.sqrt(timestep) * sigma_elem / 2. - timestep**1.5 * inputs.friction * sigma_elem / 8.
-        c5_elem = timestep**1.5 * sigma_elem / (2 * np.sqrt(3))
-        c4_elem = inputs.friction / 2. * c5_elem
-
-        c3[inputs.idx_atom] = c3_elem
-        c4[inputs.idx_atom] = c4_elem
-        c5[inputs.idx_atom] = c5_elem
-
-        # c3, c4, c5 = [], [], []
-
-        # for idx_atom, (F_std, mass) in enumerate(zip(F_step_norm_std, masses)):
-        #     uncert_ratio = (F_std - criteria_collected.Un_Abs_F_avg_i*0.9) / (criteria_collected.Un_Abs_F_std_i * 0.1)
-        #     temp_ratio = 1.0 if uncert_ratio < 0 else 100.0 if uncert_ratio > 99 else uncert_ratio + 1
-        #     if temp_ratio > 1.0:
-        #         print(f'Step {MD_step_index}; temp activate (atom {idx_atom}):{temp_ratio}')
-        #     sigma_elem = np.sqrt(2 * (temperature * temp_ratio) * inputs.friction / mass[0])
-        #     c3_elem = np.sqrt(timestep) * sigma_elem / 2. - timestep**1.5 * inputs.friction * sigma_elem / 8.
-        #     c5_elem = timestep**1.5 * sigma_elem / (2 * np.sqrt(3))
-        #     c4_elem = inputs.friction / 2. * c5_elem
-
-        #     c3.append(c3_elem)
-        #     c4.append(c4_elem)
-        #     c5.append(c5_elem)
-
-        # c3 = np.array(c3)[:, np.newaxis]
-        # c4 = np.array(c4)[:, np.newaxis]
-        # c5 = np.array(c5)[:, np.newaxis]
-
-        # mpi_print(f'Step 8: {time.time()-time_init}', rank)
-        # Get get changes of positions and velocities
-        rnd_pos = c5 * eta
-        rnd_vel = c3 * xi - c4 * eta
+    forces, step_std = get_forces_temp(struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, inputs.anharmonic_F, criteria_collected, inputs.al_type, E_ref, forces_buf, energy_buf, want_std, diff_buf)
+
+    # Sample the random numbers for the temperature fluctuation in batches
+    # that fit in the memory budget (xi and eta of natoms*3 float64 per step)
+    rng = np.random.default_rng()
+    nrandom_batch = max(1, nrandom_bytes // (natoms * 3 * 8 * 2))
+    xi_buf = np.empty((nrandom_batch, natoms, 3))
+    eta_buf = np.empty((nrandom_batch, natoms, 3))
+    rng_index = nrandom_batch
+
+    # Velocities are recalculated after each step only with constraints
+    constrained = len(struc.constraints) > 0
+
+    # Keep the record files open during MD (line-buffered for restarts);
+    # the ones already opened are closed even if the MD stops with an error
+    write_traj, trajfile, file_log = None, None, None
+    try:
+        write_traj = TrajectoryWriter(
+            filename=f'TRAJ/traj-{condition}_{inputs.index+1}.traj',
+            mode='a'
+            )
+        trajfile = open(f'UNCERT/uncertainty-{condition}_{inputs.index}.txt', 'a', buffering=1)
+        if isinstance(logfile, str):
+            file_log = open(logfile, 'a', buffering=1)
+
+        # mpi_print(f'Step 3: {time.time()-time_init}', rank)
+        # Go trough steps until the requested number of steps
+        # If appending, it starts from Langevin_idx. Otherwise, Langevin_idx = 0
+        while (MD_index < inputs.ntotal) or (inputs.calc_type == 'period' and MD_step_index < inputs.nperiod*inputs.loginterval):
+
+            accept = '--         '
+
+            # mpi_print(f'Step 6: {time.time()-time_init}', rank)
+            # Get averaged forces and velocities
+            if forces is None:
+                forces, step_std = get_forces_temp(struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, inputs.anharmonic_F, criteria_collected, inputs.al_type, E_ref, forces_buf, energy_buf, want_std, diff_buf)
+            # Velocity is already calculated based on averaged forces
+            # in the previous step
+            velocity = struc.get_velocities()
         
-        # Check the center of mass
-        if fix_com:
-            rnd_pos -= rnd_pos.sum(axis=0) / natoms
-            rnd_vel -= (rnd_vel * masses).sum(axis=0) / (masses * natoms)
-            
-        # First halfstep in the velocity.
-        velocity += (c1 * forces / masses - c2 * velocity + rnd_vel)
+            # mpi_print(f'Step 7: {time.time()-time_init}', rank)
+            # Sample the random numbers for the temperature fluctuation
+            if rng_index == nrandom_batch:
+                rng.standard_normal(out=xi_buf)
+                rng.standard_normal(out=eta_buf)
+                rng_index = 0
+            xi = xi_buf[rng_index]
+            eta = eta_buf[rng_index]
+            rng_index += 1
+
+            # mpi_print(f'Step 5: {time.time()-time_init}', rank)
+            if want_std:
+                uncert_diff = step_std[inputs.idx_atom] - uncert_avg
+                uncert_ratio = uncert_diff / uncert_std
+                temp_ratio = 1.0 if uncert_diff < 0 else math.exp((-1/2) * uncert_ratio * uncert_ratio)
+
+                single_print(f'Step {MD_step_index}; temp activate (atom {inputs.idx_atom}):{temp_ratio}')
+
+            # mpi_print(f'Step 8: {time.time()-time_init}', rank)
+            # Get get changes of positions and velocities
+            # and take the first halfstep in the velocity.
+            step_fn(velocity, forces, xi, eta, temp_ratio)
         
-        # mpi_print(f'Step 9: {time.time()-time_init}', rank)
-        # Full step in positions
-        position = struc.get_positions()
+            # mpi_print(f'Step 9: {time.time()-time_init}', rank)
+            # Full step in positions
+            position = struc.get_positions()
         
-        # Step: x^n -> x^(n+1) - this applies constraints if any.
-        struc.set_positions(position + timestep * velocity + rnd_pos)
-
-        # mpi_print(f'Step 10: {time.time()-time_init}', rank)
-        # recalc velocities after RATTLE constraints are applied
-        velocity = (struc.get_positions() - position - rnd_pos) / timestep
-        # mpi_print(f'Step 10-1: {time.time()-time_init}', rank)
-        forces, step_std = get_forces_temp(struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, inputs.anharmonic_F, criteria_collected, inputs.al_type, E_ref)
+            # Step: x^n -> x^(n+1) - this applies constraints if any.
+            position_new = np.multiply(timestep, velocity)
+            position_new += position
+            position_new += rnd_pos
+            struc.set_positions(position_new)
+
+            # mpi_print(f'Step 10: {time.time()-time_init}', rank)
+            # recalc velocities after RATTLE constraints are applied
+            # (without constraints, the velocities are unchanged)
+            if constrained:
+                velocity = (struc.get_positions() - position - rnd_pos) / timestep
+            # mpi_print(f'Step 10-1: {time.time()-time_init}', rank)
+            forces, step_std = get_forces_temp(struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, inputs.anharmonic_F, criteria_collected, inputs.al_type, E_ref, forces_buf, energy_buf, want_std, diff_buf)
         
-        # mpi_print(f'Step 10-2: {time.time()-time_init}', rank)
-        # Update the velocities
-        velocity += (c1 * forces / masses - c2 * velocity + rnd_vel)
+            # mpi_print(f'Step 10-2: {time.time()-time_init}', rank)
+            # Update the velocities
+            halfstep_fn(velocity, forces)
 
-        # mpi_print(f'Step 10-3: {time.time()-time_init}', rank)
-        # Second part of RATTLE taken care of here
-        struc.set_momenta(velocity * masses)
+            # mpi_print(f'Step 10-3: {time.time()-time_init}', rank)
+            # Second part of RATTLE taken care of here
+            struc.set_momenta(velocity * masses)
         
-        # mpi_print(f'Step 11: {time.time()-time_init}', rank)
-        # Log MD information at regular intervals
-        if (MD_step_index+1) % inputs.loginterval == 0:
-
-            # Get absolute and relative uncertainties of energy and force
-            # and also total energy
-            uncerts, Epot_step, S_step =\
-            eval_uncert(struc, inputs.nstep, inputs.nmodel, E_ref, calculator, inputs.al_type, inputs.harmonic_F)
-
-            # Get a criteria probability from uncertainty and energy informations
-            criteria = get_criteria_prob(inputs, Epot_step, uncerts, criteria_collected)
-
-            # Acceptance check with criteria
-            ##!! Epot_step should be rechecked.
-            if random.random() < criteria: # and Epot_step > 0.1:
-                accept = 'Accepted'
-                MD_index += 1
-                write_traj.write(atoms=struc)
-            else:
-                accept = 'Vetoed'
-
-            # Record the MD results at the current step
-            trajfile = open(f'UNCERT/uncertainty-{condition}_{inputs.index}.txt', 'a')
-            trajfile.write(
-                '{:.5e}'.format(Decimal(str(struc.get_temperature()))) + '\t' +
-                uncert_strconvter(uncerts.UncertAbs_E) + '\t' +
-                uncert_strconvter(uncerts.UncertRel_E) + '\t' +
-                uncert_strconvter(uncerts.UncertAbs_F) + '\t' +
-                uncert_strconvter(uncerts.UncertRel_F) + '\t' +
-                uncert_strconvter(uncerts.UncertAbs_S) + '\t' +
-                uncert_strconvter(uncerts.UncertRel_S) + '\t' +
-                uncert_strconvter(Epot_step) + '\t' +
-                uncert_strconvter(S_step) + '\t' +
-                str(MD_index) + '          \t' +
-                '{:.5e}'.format(Decimal(str(criteria))) + '\t' +
-                str(accept) + '   \n'
-            )
-            trajfile.close()
+            # mpi_print(f'Step 11: {time.time()-time_init}', rank)
+            # Log MD information at regular intervals
+            if (MD_step_index+1) % inputs.loginterval == 0:
 
-            if isinstance(logfile, str):
-                # mpi_print(f'Step 12: {time.time()-time_init}', rank)
-                info_TE, info_PE, info_KE, info_T = get_MDinfo_temp(
-                    struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, E_ref
-                    )
+                # Get absolute and relative uncertainties of energy and force
+                # and also total energy
+                # (Reuse the ensemble predictions from get_forces_temp at this step)
+                uncerts, Epot_step, S_step =\
+                eval_uncert(struc, inputs.nstep, inputs.nmodel, E_ref, calculator, inputs.al_type, inputs.harmonic_F, (energy_buf, forces_buf))
 
-                # mpi_print(f'Step 14: {time.time()-time_init}', rank)
-                file_log = open(logfile, 'a')
-                simtime = timestep*(MD_step_index+inputs.loginterval)/units.fs/1000
-                file_log.write(
-                    '{:.5f}'.format(Decimal(str(simtime))) + '   \t' +
-                    '{:.5e}'.format(Decimal(str(info_TE))) + '\t' +
-                    '{:.5e}'.format(Decimal(str(info_PE))) + '\t' +
-                    '{:.5e}'.format(Decimal(str(info_KE))) + '\t' +
-                    '{:.2f}'.format(Decimal(str(info_T)))
-                    )
-                if signal_uncert:
+                # Get a criteria probability from uncertainty and energy informations
+                criteria = get_criteria_prob(inputs, Epot_step, uncerts, criteria_collected)
+
+                # Acceptance check with criteria
+                ##!! Epot_step should be rechecked.
+                if random.random() < criteria: # and Epot_step > 0.1:
+                    accept = 'Accepted'
+                    MD_index += 1
+                    write_traj.write(atoms=struc)
+                else:
+                    accept = 'Vetoed'
+
+                # Record the MD results at the current step
+                trajfile.write(
+                    f'{struc.get_temperature():.5e}'
+                    f'\t{uncert_strconvter(uncerts.UncertAbs_E)}'
+                    f'\t{uncert_strconvter(uncerts.UncertRel_E)}'
+                    f'\t{uncert_strconvter(uncerts.UncertAbs_F)}'
+                    f'\t{uncert_strconvter(uncerts.UncertRel_F)}'
+                    f'\t{uncert_strconvter(uncerts.UncertAbs_S)}'
+                    f'\t{uncert_strconvter(uncerts.UncertRel_S)}'
+                    f'\t{uncert_strconvter(Epot_step)}'
+                    f'\t{uncert_strconvter(S_step)}'
+                    f'\t{MD_index}          \t{criteria:.5e}\t{accept}   \n'
+                )
+
+                if isinstance(logfile, str):
+                    # mpi_print(f'Step 12: {time.time()-time_init}', rank)
+                    # Atomic energies are stored for 'energy_max' and cannot be reused
+                    info_TE, info_PE, info_KE, info_T = get_MDinfo_temp(
+                        struc, inputs.nstep, inputs.nmodel, calculator, inputs.harmonic_F, E_ref,
+                        Epot = None if inputs.al_type == 'energy_max' else energy_buf
+                        )
+
+                    # mpi_print(f'Step 14: {time.time()-time_init}', rank)
+                    simtime = timestep*(MD_step_index+inputs.loginterval)/units.fs/1000
                     file_log.write(
-                        '      \t' +
-                        uncert_strconvter(uncerts.UncertAbs_E) + '\t' +
-                        uncert_strconvter(uncerts.UncertRel_E) + '\t' +
-                        uncert_strconvter(uncerts.UncertAbs_F) + '\t' +
-                        uncert_strconvter(uncerts.UncertRel_F) + '\t' +
-                        uncert_strconvter(uncerts.UncertAbs_S) + '\t' +
-                        uncert_strconvter(uncerts.UncertRel_S) + '\t' +
-                        uncert_strconvter(S_step) + '\n'
+                        f'{simtime:.5f}   \t{info_TE:.5e}\t{info_PE:.5e}\t{info_KE:.5e}\t{info_T:.2f}'
                         )
-                else:
-                    file_log.write('\n')
-                file_log.close()
-                # mpi_print(f'Step 15: {time.time()-time_init}', rank)
-            file_traj.write(atoms=struc)
+                    if signal_uncert:
+                        file_log.write(
+                            f'      \t{uncert_strconvter(uncerts.UncertAbs_E)}'
+                            f'\t{uncert_strconvter(uncerts.UncertRel_E)}'
+                            f'\t{uncert_strconvter(uncerts.UncertAbs_F)}'
+                            f'\t{uncert_strconvter(uncerts.UncertRel_F)}'
+                            f'\t{uncert_strconvter(uncerts.UncertAbs_S)}'
+                            f'\t{uncert_strconvter(uncerts.UncertRel_S)}'
+                            f'\t{uncert_strconvter(S_step)}\n'
+                            )
+                    else:
+                        file_log.write('\n')
+                    # mpi_print(f'Step 15: {time.time()-time_init}', rank)
+                file_traj.write(atoms=struc)
+
+            MD_step_index += 1
+            # mpi_print(f'Step 16: {time.time()-time_init}', rank)
+
+    finally:
+        for handle in (write_traj, trajfile, file_log):
+            if handle is not None:
+                handle.close()
+
+
+def _make_langevin_step(
+    langevin_step, langevin_halfstep, masses, timestep, friction,
+    temperature, temp_factor_kB, idx_atom, fix_com, rnd_pos, rnd_vel
+):
+    """Function [_make_langevin_step]
+    Bind the fixed MD settings to the Langevin integrator steps.
+
+    Parameters:
+
+    langevin_step, langevin_halfstep: function
+        The integrator steps of the selected backend
+    masses: np.array of float
+        An array of atoms' masses with a shape of (natoms, 1)
+    timestep: float
+        MD timestep in ASE units
+    friction: float
+        Strength of the friction parameter in NVTLangevin ensemble
+    temperature: float
+        The desired temperature in units of eV
+    temp_factor_kB: float
+        The maximum additional temperature of the heated atom in units of eV
+    idx_atom: int
+        The index of the heated atom
+    fix_com: bool
+        If True, the center of mass is kept unperturbed
+    rnd_pos, rnd_vel: np.array of float
+        Scratch arrays for random changes of positions and velocities
+
+    Returns:
+
+    step_fn: function
+        The first halfstep taking (velocity, forces, xi, eta, temp_ratio);
+        with temp_ratio of None, the heated atom has the base temperature
+    halfstep_fn: function
+        The second halfstep taking (velocity, forces)
+    """
+
+    c1, c2, c3, c4, c5 = _langevin_coeffs(masses, timestep, friction, temperature)
+    mass_elem = masses[idx_atom][0]
+    coeffs_base = (c3[idx_atom][0], c4[idx_atom][0], c5[idx_atom][0])
+
+    def step_fn(velocity, forces, xi, eta, temp_ratio=None):
+        if temp_ratio is None:
+            c3_elem, c4_elem, c5_elem = coeffs_base
+        else:
+            # Only the coefficients of the heated atom depend on the uncertainty
+            _, _, c3_elem, c4_elem, c5_elem = _langevin_coeffs(
+                mass_elem, timestep, friction, temperature + temp_ratio * temp_factor_kB
+                )
+        langevin_step(
+            velocity, forces, masses, xi, eta, c1, c2, c3, c4, c5,
+            idx_atom, c3_elem, c4_elem, c5_elem, fix_com, rnd_pos, rnd_vel
+            )
+
+    def halfstep_fn(velocity, forces):
+        langevin_halfstep(velocity, forces, masses, c1, c2, rnd_vel)
 
-        MD_step_index += 1
-        # mpi_print(f'Step 16: {time.time()-time_init}', rank)
+    return step_fn, halfstep_fn
+
+
+def _langevin_coeffs(masses, timestep, friction, temperature):
+    """Function [_langevin_coeffs]
+    Get the coefficients of the Langevin integrator.
+
+    Parameters:
+
+    masses: np.array of float or float
+        An array of atoms' masses with a shape of (natoms, 1)
+    timestep: float
+        MD timestep in ASE units
+    friction: float
+        Strength of the friction parameter in NVTLangevin ensemble
+    temperature: float
+        The desired temperature in units of eV
+
+    Returns:
+
+    c1, c2: float
+        Langevin coefficients independent of atoms
+    c3, c4, c5: np.array of float or float
+        Langevin coefficients with the same shape of masses
+    """
+
+    sigma = np.sqrt(2 * temperature * friction / masses)
+    c1 = timestep / 2. - timestep * timestep * friction / 8.
+    c2 = timestep * friction / 2 - timestep * timestep * friction * friction / 8.
+    c3 = np.sqrt(timestep) * sigma / 2. - timestep**1.5 * friction * sigma / 8.
+    c5 = timestep**1.5 * sigma / (2 * np.sqrt(3))
+    c4 = friction / 2. * c5
+
+    return c1, c2, c3, c4, c5
+
+
+@njit(fastmath=True, cache=True)
+def _langevin_step(
+    velocity, forces, masses, xi, eta, c1, c2, c3, c4, c5,
+    idx_atom, c3_elem, c4_elem, c5_elem, fix_com, rnd_pos, rnd_vel
+):
+    """Function [_langevin_step]
+    Get the random changes of positions and velocities
+    and take the first halfstep in the velocity (in-place).
+    The coefficients of the atom idx_atom are replaced
+    by c3_elem, c4_elem, and c5_elem.
+
+    Parameters:
+
+    velocity: np.array of float
+        Velocities of atoms; updated in-place
+    forces: np.array of float
+        Averaged forces across trained models
+    masses: np.array of float
+        An array of atoms' masses with a shape of (natoms, 1)
+    xi, eta: np.array of float
+        Standard normal random numbers with a shape of (natoms, 3)
+    c1, c2: float
+        Langevin coefficients independent of atoms
+    c3, c4, c5: np.array of float
+        Langevin coefficients with a shape of (natoms, 1)
+    idx_atom: int
+        The index of the heated atom
+    c3_elem, c4_elem, c5_elem: float
+        Langevin coefficients of the heated atom
+    fix_com: bool
+        If True, the position and momentum of the center of mass is
+        kept unperturbed.
+    rnd_pos: np.array of float
+        Random changes of positions; written in-place
+    rnd_vel: np.array of float
+        Random changes of velocities; written in-place
+    """
+
+    natoms = velocity.shape[0]
+    com_pos = np.zeros(3)
+    com_mom = np.zeros(3)
+
+    # First pass: random changes and their sums for the center of mass
+    for i in range(natoms):
+        if i == idx_atom:
+            c3_i, c4_i, c5_i = c3_elem, c4_elem, c5_elem
+        else:
+            c3_i, c4_i, c5_i = c3[i, 0], c4[i, 0], c5[i, 0]
+        for k in range(3):
+            rnd_pos[i, k] = c5_i * eta[i, k]
+            rnd_vel[i, k] = c3_i * xi[i, k] - c4_i * eta[i, k]
+            com_pos[k] += rnd_pos[i, k]
+            com_mom[k] += rnd_vel[i, k] * masses[i, 0]
+
+    # Check the center of mass
+    if fix_com:
+        com_pos /= natoms
+        com_mom /= natoms
+    else:
+        com_pos[:] = 0.
+        com_mom[:] = 0.
+
+    # Second pass: remove the center of mass motion
+    # and take the first halfstep in the velocity
+    for i in range(natoms):
+        for k in range(3):
+            rnd_pos[i, k] -= com_pos[k]
+            rnd_vel[i, k] -= com_mom[k] / masses[i, 0]
+            velocity[i, k] += c1 * forces[i, k] / masses[i, 0] - c2 * velocity[i, k] + rnd_vel[i, k]
+
+
+@njit(fastmath=True, cache=True)
+def _langevin_halfstep(velocity, forces, masses, c1, c2, rnd_vel):
+    """Function [_langevin_halfstep]
+    Take a halfstep in the velocity (in-place).
+
+    Parameters:
+
+    velocity: np.array of float
+        Velocities of atoms; updated in-place
+    forces: np.array of float
+        Averaged forces across trained models
+    masses: np.array of float
+        An array of atoms' masses with a shape of (natoms, 1)
+    c1, c2: float
+        Langevin coefficients independent of atoms
+    rnd_vel: np.array of float
+        Random changes of velocities
+    """
+
+    for i in range(velocity.shape[0]):
+        for k in range(3):
+            velocity[i, k] += c1 * forces[i, k] / masses[i, 0] - c2 * velocity[i, k] + rnd_vel[i, k]
+
+
+def _langevin_step_numpy(
+    velocity, forces, masses, xi, eta, c1, c2, c3, c4, c5,
+    idx_atom, c3_elem, c4_elem, c5_elem, fix_com, rnd_pos, rnd_vel
+):
+    """Function [_langevin_step_numpy]
+    NumPy version of _langevin_step, which does not need the JIT compilation.
+    Parameters are the same as _langevin_step.
+    """
+
+    natoms = velocity.shape[0]
+    np.multiply(c5, eta, out=rnd_pos)
+    np.multiply(c3, xi, out=rnd_vel)
+    rnd_vel -= c4 * eta
+    rnd_pos[idx_atom] = c5_elem * eta[idx_atom]
+    rnd_vel[idx_atom] = c3_elem * xi[idx_atom] - c4_elem * eta[idx_atom]
+
+    # Check the center of mass
+    if fix_com:
+        rnd_pos -= rnd_pos.sum(axis=0) / natoms
+        rnd_vel -= np.einsum('ni,nk->k', masses, rnd_vel) / (masses * natoms)
+
+    _langevin_halfstep_numpy(velocity, forces, masses, c1, c2, rnd_vel)
+
+
+def _langevin_halfstep_numpy(velocity, forces, masses, c1, c2, rnd_vel):
+    """Function [_langevin_halfstep_numpy]
+    NumPy version of _langevin_halfstep, which does not need the JIT compilation.
+    Parameters are the same as _langevin_halfstep.
+    """
+
+    # Update in place with a single temporary array for the forces
+    velocity *= 1. - c2
+    velocity += rnd_vel
+    force_term = np.divide(forces, masses)
+    force_term *= c1
+    velocity += force_term
 
 
 def get_forces_temp(
-    struc, nstep, nmodel, calculator, harmonic_F, anharmonic_F, criteria, al_type, E_ref
+    struc, nstep, nmodel, calculator, harmonic_F, anharmonic_F, criteria, al_type, E_ref,
+    forces_buf=None, energy_buf=None, want_std=True, diff_buf=None
 ):
     """Function [get_forces]
     Evalulate the average of forces from all different trained models.
@@ -358,47 +598,51 @@ def get_forces_temp(
         The number of ensemble model sets with different initialization
     calculator: ASE calculator or list of ASE calculators
         Calculators from trained models
+    forces_buf: np.array of float (optional)
+        Preallocated buffer of predicted forces
+        with a shape of (nmodel*nstep, natoms, 3)
+    energy_buf: np.array of float (optional)
+        Preallocated buffer of predicted energies with a shape of
+        (nmodel*nstep, natoms) for 'energy_max' or (nmodel*nstep,) otherwise
+    want_std: bool (optional)
+        If False, only averaged forces are evaluated
+        and None is returned for the uncertainty
+    diff_buf: np.array of float (optional)
+        Preallocated buffer of force deviations with the shape of forces_buf;
+        its dtype sets the precision of the uncertainty reduction
 
     Returns:
 
     force_avg: np.array of float
         Averaged forces across trained models
+    step_std: np.array of float or None
+        Uncertainty of atomic energies ('energy_max') or forces
     """
 
     # time_init = time.time()
-    from libs.lib_util import eval_sigma
 
     # mpi_print(f'Step 10-a: {time.time()-time_init}', rank)
     if type(calculator) == list:
-        energy = []
-        forces = []
-        sigmas = []
-        zndex = 0
-        for index_nmodel in range(nmodel):
-            for index_nstep in range(nstep):
-                # mpi_print(f'Step 10-a1 first {rank}: {time.time()-time_init}', rank)
-                struc.calc = calculator[zndex]
-                # mpi_print(f'Step 10-a1 second {rank}: {time.time()-time_init}', rank)
-                temp_force = struc.get_forces()
-                # mpi_print(f'Step 10-a1 third {rank}: {time.time()-time_init}', rank)
-                if al_type == 'energy_max':
-                    energy.append(struc.get_potential_energies() - E_ref[1][zndex])
-                else:
-                    energy.append(struc.get_potential_energy() - E_ref[0][zndex])
-                forces.append(temp_force)
-                # sigmas.append(eval_sigma(temp_force, struc.get_positions(), 'force_max'))
-                # mpi_print(f'Step 10-a1 last {rank}: {time.time()-time_init}', rank)
-                zndex += 1
-        # mpi_print(f'Step 10-a2: {time.time()-time_init}', rank)
-        # sigmas = comm.allgather(sigmas)
-        # mpi_print(f'Step 10-a3: {time.time()-time_init}', rank)
-        E_step_avg = np.average(energy, axis=0)
-        E_step_std = np.std(energy, axis=0)
-
-        F_step_avg = np.average(forces, axis=0)
-        F_step_norm = np.array([[np.linalg.norm(Fcomp) for Fcomp in Ftems] for Ftems in forces - F_step_avg])
-        F_step_norm_std = np.sqrt(np.average(F_step_norm ** 2, axis=0))
-        F_step_norm_avg = np.linalg.norm(F_step_avg, axis=1)
+        # Get predicted energies and forces of all trained models at once
+        energy_buf, forces_buf = get_ensemble(
+            struc, nstep, nmodel, calculator, E_ref, al_type, forces_buf, energy_buf
+            )
+        F_step_avg = forces_buf.mean(axis=0)
+        if not want_std:
+            return F_step_avg, None
+
+        E_step_std = energy_buf.std(axis=0)
+
+        # Root mean square of the deviation norms across trained models
+        if diff_buf is None:
+            F_step_diff = forces_buf - F_step_avg
+        else:
+            F_step_diff = np.subtract(
+                forces_buf, F_step_avg, out=diff_buf, casting='same_kind'
+                )
+        F_step_norm_std = np.sqrt(
+            np.einsum('mnk,mnk->n', F_step_diff, F_step_diff) / len(forces_buf)
+            )
 
         # uncert_idcs = np.where((F_step_norm_std - criteria.Un_Abs_F_avg_i) > criteria.Un_Abs_F_std_i * 0.5)[0]
         # print(f'uncert_idcs:{uncert_idcs}')
@@ -1,14 +1,18 @@
 import os
 import sys
+import math
 import numpy as np
 import pandas as pd
-from decimal import Decimal
-from scipy import special
+from functools import lru_cache
+from numba import njit
 from libs.lib_util import single_print
 
+# Width factor of the erf function in get_criteria_uncert
+_SQRT_02 = math.sqrt(2 * 0.1)
+
 
 def eval_uncert(
-    struc_step, nstep, nmodel, E_ref, calculator, al_type, harmonic_F
+    struc_step, nstep, nmodel, E_ref, calculator, al_type, harmonic_F, ensemble=None
 ):
     """Function [eval_uncert]
     Evalulate the absolute and relative uncertainties of
@@ -28,6 +32,9 @@ def eval_uncert(
         Calculators from trained models
     al_type: str
         Type of active learning: 'energy', 'force', 'force_max'
+    ensemble: tuple of np.array of float (optional)
+        Predicted energies and forces of all trained models
+        already evaluated at the current step (e.g. from get_ensemble)
 
     Returns:
 
@@ -45,7 +52,7 @@ def eval_uncert(
     # Active learning based on the uncertainty of predicted energy
 
     Epot_step_avg, Epot_step_std, F_step_norm_avg, F_step_norm_std, S_step_avg, S_step_std\
-    = eval_uncert_all(struc_step, nstep, nmodel, E_ref, calculator, al_type, harmonic_F)
+    = eval_uncert_all(struc_step, nstep, nmodel, E_ref, calculator, al_type, harmonic_F, ensemble)
 
     from libs.lib_util import empty_inputs
     uncerts = empty_inputs()
@@ -53,8 +60,8 @@ def eval_uncert(
     if al_type == 'energy' or al_type == 'force' or al_type == 'sigma' or al_type == 'all':
         uncerts.UncertAbs_E = Epot_step_std
         uncerts.UncertRel_E = Epot_step_std / Epot_step_avg
-        uncerts.UncertAbs_F = np.average(F_step_norm_std)
-        uncerts.UncertRel_F = np.average(F_step_norm_std / F_step_norm_avg)
+        uncerts.UncertAbs_F = F_step_norm_std.mean()
+        uncerts.UncertRel_F = (F_step_norm_std / F_step_norm_avg).mean()
         uncerts.UncertAbs_S = S_step_std
         uncerts.UncertRel_S = S_step_std / S_step_avg
 
@@ -64,24 +71,18 @@ def eval_uncert(
     elif al_type == 'force_max':
         uncerts.UncertAbs_E = Epot_step_std
         uncerts.UncertRel_E = Epot_step_std / Epot_step_avg
-        uncerts.UncertAbs_F = np.ndarray.max(F_step_norm_std)
-        uncerts.UncertRel_F = np.ndarray.max(
-            np.array([std / avg for avg, std in zip(F_step_norm_avg, F_step_norm_std)])
-            )
+        uncerts.UncertAbs_F = F_step_norm_std.max()
+        uncerts.UncertRel_F = (F_step_norm_std / F_step_norm_avg).max()
         uncerts.UncertAbs_S = S_step_std
         uncerts.UncertRel_S = S_step_std / S_step_avg
 
         return (uncerts, Epot_step_avg, S_step_avg)
 
     elif al_type == 'energy_max':
-        uncerts.UncertAbs_E = np.max(Epot_step_std)
-        uncerts.UncertRel_E = np.max(
-            np.array([std / np.absolute(avg) for avg, std in zip(Epot_step_avg, Epot_step_std)])
-            )
-        uncerts.UncertAbs_F = np.ndarray.max(F_step_norm_std)
-        uncerts.UncertRel_F = np.ndarray.max(
-            np.array([std / avg for avg, std in zip(F_step_norm_avg, F_step_norm_std)])
-            )
+        uncerts.UncertAbs_E = Epot_step_std.max()
+        uncerts.UncertRel_E = (Epot_step_std / np.absolute(Epot_step_avg)).max()
+        uncerts.UncertAbs_F = F_step_norm_std.max()
+        uncerts.UncertRel_F = (F_step_norm_std / F_step_norm_avg).max()
         uncerts.UncertAbs_S = S_step_std
         uncerts.UncertRel_S = S_step_std / S_step_avg
 
@@ -92,7 +93,7 @@ def eval_uncert(
         
 
 def eval_uncert_all(
-    struc_step, nstep, nmodel, E_ref, calculator, al_type, harmonic_F
+    struc_step, nstep, nmodel, E_ref, calculator, al_type, harmonic_F, ensemble=None
 ):
     """Function [eval_uncert_E]
     Evalulate the average and standard deviation of predicted energies.
@@ -111,6 +112,9 @@ def eval_uncert_all(
         Calculators from trained models
     al_type: str
         Type of active learning: 'energy', 'force', 'force_max'
+    ensemble: tuple of np.array of float (optional)
+        Predicted energies and forces of all trained models
+        already evaluated at the current step (e.g. from get_ensemble)
 
     Returns:
 
@@ -122,27 +126,19 @@ def eval_uncert_all(
 
     # from mpi4py import MPI
     from libs.lib_util import eval_sigma
-
-    # Prepare empty lists for potential and total energies
-    Epot_step = []
-    F_step = []
-    prd_struc = []
-    zndex = 0
-    natoms = len(struc_step)
+    from libs.lib_MD_util import get_ensemble
 
     # Get predicted potential and total energies shifted by E_ref (ground state energy)
-    for index_nmodel in range(nmodel):
-        for index_nstep in range(nstep):
-            struc_step.calc = calculator[zndex]
-
-            if al_type == 'energy_max':
-                Epot_step.append(np.array(struc_step.get_potential_energies()) - E_ref[1][zndex])
-            else:
-                Epot_step.append(struc_step.get_potential_energy() - E_ref[0][zndex])
-
-            F_step.append(struc_step.get_forces())
-            prd_struc.append(struc_step.get_positions())
-            zndex += 1
+    if ensemble is not None:
+        # Reuse the predictions already evaluated at the current step
+        Epot_step, F_step = ensemble
+    else:
+        # Stack the predictions of all trained models into fixed-size arrays
+        Epot_step, F_step = get_ensemble(
+            struc_step, nstep, nmodel, calculator, E_ref, al_type
+            )
+    # All trained models predict at the same positions
+    prd_struc = [struc_step.get_positions()] * len(F_step)
 
     # Get the average and standard deviation of predicted potential energies
     # Get the average and standard deviation of the norm of predicted forces
@@ -154,13 +150,10 @@ def eval_uncert_all(
         Epot_step = Epot_step + E_ha
         F_step = F_step + F_ha
 
-    Epot_step_avg = np.average(Epot_step, axis=0)
-    Epot_step_std = np.std(Epot_step, axis=0)
+    Epot_step_avg = Epot_step.mean(axis=0)
+    Epot_step_std = Epot_step.std(axis=0)
 
-    F_step_avg = np.average(F_step, axis=0)
-    F_step_norm = np.array([[np.linalg.norm(Fcomp) for Fcomp in Ftems] for Ftems in F_step - F_step_avg])
-    F_step_norm_std = np.sqrt(np.average(F_step_norm ** 2, axis=0))
-    F_step_norm_avg = np.linalg.norm(F_step_avg, axis=1)
+    F_step_norm_avg, F_step_norm_std = _force_stats(np.ascontiguousarray(F_step, dtype=np.float64))
 
     prd_sigma = []
     for prd_F_step, prd_struc_step in zip(F_step, prd_struc):
@@ -173,6 +166,47 @@ def eval_uncert_all(
     return Epot_step_avg, Epot_step_std, F_step_norm_avg, F_step_norm_std, sigma_step_avg, sigma_step_std
 
 
+@njit(fastmath=True, cache=True)
+def _force_stats(F_step):
+    """Function [_force_stats]
+    Get the norm of averaged forces and the root mean square
+    of the deviation norms across trained models in a single pass
+    over the ensemble (Welford's algorithm).
+
+    Parameters:
+
+    F_step: np.array of float
+        Predicted forces with a shape of (nmodel*nstep, natoms, 3)
+
+    Returns:
+
+    F_step_norm_avg: np.array of float
+        Norm of averaged forces of each atom
+    F_step_norm_std: np.array of float
+        Root mean square of the deviation norms of each atom
+    """
+    nensemble, natoms, _ = F_step.shape
+    F_step_norm_avg = np.empty(natoms)
+    F_step_norm_std = np.empty(natoms)
+
+    for i in range(natoms):
+        norm_sq = 0.0
+        var_sum = 0.0
+        for k in range(3):
+            mean = 0.0
+            M2 = 0.0
+            for m in range(nensemble):
+                delta = F_step[m, i, k] - mean
+                mean += delta / (m + 1)
+                M2 += delta * (F_step[m, i, k] - mean)
+            norm_sq += mean * mean
+            var_sum += M2
+        F_step_norm_avg[i] = math.sqrt(norm_sq)
+        F_step_norm_std[i] = math.sqrt(var_sum / nensemble)
+
+    return F_step_norm_avg, F_step_norm_std
+
+
 def get_criteria(
     temperature, pressure, index, steps_init, al_type
 ):
@@ -219,11 +253,17 @@ def get_criteria(
     from libs.lib_util import empty_inputs
     criteria = empty_inputs()
 
-    # Read all uncertainty results
-    result_data = pd.read_csv(
-        f'result.txt',
-        index_col=False, delimiter='\t'
-        )
+    # Read the uncertainty results required for al_type
+    result_cols = ['E_potent_avg_i', 'E_potent_std_i']
+    if al_type == 'energy' or al_type == 'energy_max':
+        result_cols += ['Un_Abs_E_avg_i', 'Un_Abs_E_std_i', 'Un_Rel_E_avg_i', 'Un_Rel_E_std_i']
+    if al_type == 'energy_max':
+        result_cols += ['Un_Abs_Ea_avg_i', 'Un_Abs_Ea_std_i', 'Un_Rel_Ea_avg_i', 'Un_Rel_Ea_std_i']
+    if al_type == 'force' or al_type == 'force_max':
+        result_cols += ['Un_Abs_F_avg_i', 'Un_Abs_F_std_i', 'Un_Rel_F_avg_i', 'Un_Rel_F_std_i']
+    if al_type == 'sigma' or al_type == 'sigma_max':
+        result_cols += ['Un_Abs_S_avg_i', 'Un_Abs_S_std_i', 'Un_Rel_S_avg_i', 'Un_Rel_S_std_i']
+    result_data = read_columns('result.txt', result_cols)
 
     # if ensemble == 'NVTLangevin_meta':
     #     # Get their average and standard deviation
@@ -231,14 +271,14 @@ def get_criteria(
     #     criteria.Epotential_std = result_data.loc[:, 'E_potent_std_i'].to_numpy()[0]
     # else:
     #     # Get their average and standard deviation
-    criteria.Epotential_avg = result_data.loc[:, 'E_potent_avg_i'].to_numpy()[-1]
-    criteria.Epotential_std = result_data.loc[:, 'E_potent_std_i'].to_numpy()[-1]
+    criteria.Epotential_avg = result_data['E_potent_avg_i'][-1]
+    criteria.Epotential_std = result_data['E_potent_std_i'][-1]
     
     if al_type == 'energy' or al_type == 'energy_max':
-        criteria.Un_Abs_E_avg_i = result_data.loc[:, 'Un_Abs_E_avg_i'].to_numpy()[-1]
-        criteria.Un_Abs_E_std_i = result_data.loc[:, 'Un_Abs_E_std_i'].to_numpy()[-1]
-        criteria.Un_Rel_E_avg_i = result_data.loc[:, 'Un_Rel_E_avg_i'].to_numpy()[-1]
-        criteria.Un_Rel_E_std_i = result_data.loc[:, 'Un_Rel_E_std_i'].to_numpy()[-1]
+        criteria.Un_Abs_E_avg_i = result_data['Un_Abs_E_avg_i'][-1]
+        criteria.Un_Abs_E_std_i = result_data['Un_Abs_E_std_i'][-1]
+        criteria.Un_Rel_E_avg_i = result_data['Un_Rel_E_avg_i'][-1]
+        criteria.Un_Rel_E_std_i = result_data['Un_Rel_E_std_i'][-1]
     else:
         criteria.Un_Abs_E_avg_i = 0.0
         criteria.Un_Abs_E_std_i = 0.0
@@ -246,10 +286,10 @@ def get_criteria(
         criteria.Un_Rel_E_std_i = 0.0
 
     if al_type == 'energy_max':
-        criteria.Un_Abs_Ea_avg_i = result_data.loc[:, 'Un_Abs_Ea_avg_i'].to_numpy()[-1]
-        criteria.Un_Abs_Ea_std_i = result_data.loc[:, 'Un_Abs_Ea_std_i'].to_numpy()[-1]
-        criteria.Un_Rel_Ea_avg_i = result_data.loc[:, 'Un_Rel_Ea_avg_i'].to_numpy()[-1]
-        criteria.Un_Rel_Ea_std_i = result_data.loc[:, 'Un_Rel_Ea_std_i'].to_numpy()[-1]
+        criteria.Un_Abs_Ea_avg_i = result_data['Un_Abs_Ea_avg_i'][-1]
+        criteria.Un_Abs_Ea_std_i = result_data['Un_Abs_Ea_std_i'][-1]
+        criteria.Un_Rel_Ea_avg_i = result_data['Un_Rel_Ea_avg_i'][-1]
+        criteria.Un_Rel_Ea_std_i = result_data['Un_Rel_Ea_std_i'][-1]
     else:
         criteria.Un_Abs_Ea_avg_i = 0.0
         criteria.Un_Abs_Ea_std_i = 0.0
@@ -257,10 +297,10 @@ def get_criteria(
         criteria.Un_Rel_Ea_std_i = 0.0
 
     if al_type == 'force' or al_type == 'force_max':
-        criteria.Un_Abs_F_avg_i = result_data.loc[:, 'Un_Abs_F_avg_i'].to_numpy()[-1]
-        criteria.Un_Abs_F_std_i = result_data.loc[:, 'Un_Abs_F_std_i'].to_numpy()[-1]
-        criteria.Un_Rel_F_avg_i = result_data.loc[:, 'Un_Rel_F_avg_i'].to_numpy()[-1]
-        criteria.Un_Rel_F_std_i = result_data.loc[:, 'Un_Rel_F_std_i'].to_numpy()[-1]
+        criteria.Un_Abs_F_avg_i = result_data['Un_Abs_F_avg_i'][-1]
+        criteria.Un_Abs_F_std_i = result_data['Un_Abs_F_std_i'][-1]
+        criteria.Un_Rel_F_avg_i = result_data['Un_Rel_F_avg_i'][-1]
+        criteria.Un_Rel_F_std_i = result_data['Un_Rel_F_std_i'][-1]
     else:
         criteria.Un_Abs_F_avg_i = 0.0
         criteria.Un_Abs_F_std_i = 0.0
@@ -268,10 +308,10 @@ def get_criteria(
         criteria.Un_Rel_F_std_i = 0.0
 
     if al_type == 'sigma' or al_type == 'sigma_max':
-        criteria.Un_Abs_S_avg_i = result_data.loc[:, 'Un_Abs_S_avg_i'].to_numpy()[-1]
-        criteria.Un_Abs_S_std_i = result_data.loc[:, 'Un_Abs_S_std_i'].to_numpy()[-1]
-        criteria.Un_Rel_S_avg_i = result_data.loc[:, 'Un_Rel_S_avg_i'].to_numpy()[-1]
-        criteria.Un_Rel_S_std_i = result_data.loc[:, 'Un_Rel_S_std_i'].to_numpy()[-1]
+        criteria.Un_Abs_S_avg_i = result_data['Un_Abs_S_avg_i'][-1]
+        criteria.Un_Abs_S_std_i = result_data['Un_Abs_S_std_i'][-1]
+        criteria.Un_Rel_S_avg_i = result_data['Un_Rel_S_avg_i'][-1]
+        criteria.Un_Rel_S_std_i = result_data['Un_Rel_S_std_i'][-1]
     else:
         criteria.Un_Abs_S_avg_i = 0.0
         criteria.Un_Abs_S_std_i = 0.0
@@ -303,33 +343,40 @@ def get_result(inputs, get_type):
     else:
         get_index = inputs.index
 
-    # Read all uncertainty results
-    uncert_data = pd.read_csv(
+    # Read the uncertainty results required for al_type
+    uncert_cols = []
+    if inputs.al_type == 'energy' or inputs.al_type == 'energy_max':
+        uncert_cols += ['UncertAbs_E', 'UncertRel_E']
+    if inputs.al_type == 'force' or inputs.al_type == 'force_max':
+        uncert_cols += ['UncertAbs_F', 'UncertRel_F']
+    if inputs.al_type == 'sigma' or inputs.al_type == 'sigma_max':
+        uncert_cols += ['UncertAbs_S', 'UncertRel_S']
+    uncert_data = read_columns(
         f'UNCERT/uncertainty-{inputs.temperature}K-{inputs.pressure}bar_{get_index}.txt',
-        index_col=False, delimiter='\t'
+        uncert_cols
         )
 
     result_print = ''
     # Get their average and standard deviation
     if inputs.al_type == 'energy' or inputs.al_type == 'energy_max':
-        UncerAbs_E_list = uncert_data.loc[:,'UncertAbs_E'].values
-        UncerRel_E_list = uncert_data.loc[:,'UncertRel_E'].values
+        UncerAbs_E_list = uncert_data['UncertAbs_E']
+        UncerRel_E_list = uncert_data['UncertRel_E']
         criteria_UncertAbs_E_avg_all = uncert_average(UncerAbs_E_list[:])
         criteria_UncertRel_E_avg_all = uncert_average(UncerRel_E_list[:])
         result_print +=   '\t' + uncert_strconvter(criteria_UncertRel_E_avg_all)\
                         + '\t' + uncert_strconvter(criteria_UncertAbs_E_avg_all)
 
     if inputs.al_type == 'force' or inputs.al_type == 'force_max':
-        UncerAbs_F_list = uncert_data.loc[:,'UncertAbs_F'].values
-        UncerRel_F_list = uncert_data.loc[:,'UncertRel_F'].values
+        UncerAbs_F_list = uncert_data['UncertAbs_F']
+        UncerRel_F_list = uncert_data['UncertRel_F']
         criteria_UncertAbs_F_avg_all = uncert_average(UncerAbs_F_list[:])
         criteria_UncertRel_F_avg_all = uncert_average(UncerRel_F_list[:])
         result_print +=   '\t' + uncert_strconvter(criteria_UncertRel_F_avg_all)\
                         + '\t' + uncert_strconvter(criteria_UncertAbs_F_avg_all)
 
     if inputs.al_type == 'sigma' or inputs.al_type == 'sigma_max':
-        UncerAbs_S_list = uncert_data.loc[:,'UncertAbs_S'].values
-        UncerRel_S_list = uncert_data.loc[:,'UncertRel_S'].values
+        UncerAbs_S_list = uncert_data['UncertAbs_S']
+        UncerRel_S_list = uncert_data['UncertRel_S']
         criteria_UncertAbs_S_avg_all = uncert_average(UncerAbs_S_list[:])
         criteria_UncertRel_S_avg_all = uncert_average(UncerRel_S_list[:])
         result_print +=   '\t' + uncert_strconvter(criteria_UncertAbs_S_avg_all)\
@@ -341,35 +388,75 @@ def get_result(inputs, get_type):
 
 
     
+def read_columns(filename, columns):
+    """Function [read_columns]
+    Read numeric columns of a tab-separated result file.
+    Missing values (dashed lines) are read as NaN.
+    Parsed columns are reused until the file is modified.
+
+    Parameters:
+
+    filename: str
+        A name of the tab-separated file with a header line
+    columns: list of str
+        Names of the columns to read
+
+    Returns:
+
+    data: dict of np.array of float
+        Values of each column
+    """
+    stat = os.stat(filename)
+    return _read_columns(filename, stat.st_mtime_ns, stat.st_size, tuple(columns))
+
+
+@lru_cache(maxsize=16)
+def _read_columns(filename, mtime, size, columns):
+    """Function [_read_columns]
+    Cached part of read_columns keyed by the modification time and size of the file.
+    """
+    # The C engine tolerates the partial last row written by get_testerror
+    data = pd.read_csv(
+        filename, index_col=False, delimiter='\t', usecols=list(columns), engine='c'
+        )
+    return {
+        column: pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float)
+        for column in columns
+        }
+
+
 def uncert_average(itemlist):
     """Function [uncert_average]
-    If input is list of float values, return their average.
-    Otherwise, return a string with the dashed line.
+    Return the average of float values, ignoring missing values (NaN).
+    If all values are missing, return NaN.
 
     Parameters:
 
-    itemlist: list of float or str
-        list of float values or string
+    itemlist: np.array of float
+        float values with NaN for missing values
     """
-    return '----          ' if itemlist[0] == '----          ' else np.average(itemlist)
+    itemlist = np.asarray(itemlist, dtype=float)
+    return np.nan if np.isnan(itemlist).all() else np.nanmean(itemlist)
     
     
 def uncert_std(itemlist):
     """Function [uncert_std]
-    If input is list of float values, return their standard deviation.
-    Otherwise, return a string with the dashed line.
+    Return the standard deviation of float values, ignoring missing values (NaN).
+    If all values are missing, return NaN.
 
     Parameters:
 
-    itemlist: list of float or str
-        list of float values or string
+    itemlist: np.array of float
+        float values with NaN for missing values
     """
-    return '----          ' if itemlist[0] == '----          ' else np.std(itemlist)
+    itemlist = np.asarray(itemlist, dtype=float)
+    return np.nan if np.isnan(itemlist).all() else np.nanstd(itemlist)
 
 
 def uncert_strconvter(value):
     """Function [uncert_strconvter]
-    If the input is a string, it will be returned as is.
+    If the input is a string, it will be returned as is,
+    and a missing value (NaN) is returned as a dashed line.
     Otherwise, a float number will be returned in scientific format,
     with five significant digits.
 
@@ -378,12 +465,12 @@ def uncert_strconvter(value):
     value: float or str
         any input
     """
-    if value == '----          ':
+    if isinstance(value, str):
         return value
-    if isinstance(value, np.float32):
-        value = float(value)
-    
-    return '{:.5e}'.format(Decimal(value))
+    if np.isnan(value):
+        return '----          '
+
+    return f'{float(value):.5e}'
     
 
 def get_criteria_prob(inputs, Epot_step, uncerts, criteria):
@@ -486,28 +573,25 @@ def get_criteria_prob(inputs, Epot_step, uncerts, criteria):
     else:
         sys.exit("You need to set al_type.")
 
-    beta = inputs.kB * inputs.temperature
+    # The product of probabilities vanishes without the canonical ensemble part
+    if inputs.al_type != 'EorFmax' and criteria_Uncert_E * criteria_Uncert_F * criteria_Uncert_S == 0:
+        return 0.0
 
     if inputs.ensemble == 'NVTLangevin_meta' or inputs.ensemble == 'NVTLangevin_bias' or inputs.ensemble == 'NVTLangevin_bias_temp' or inputs.ensemble == 'NPTisoiso' or inputs.criteria_energy == False:
         criteria_Prob = 1
     else:
-        # Caculate the canonical ensemble propbability using the total energy
-        Prob = np.exp((-1) * (Epot_step / inputs.NumAtoms) / beta)
-        Prob_upper_limit = np.exp(
-            (-1) * ((criteria.Epotential_avg + criteria.Epotential_std) / inputs.NumAtoms) / beta)
-        # Prob_lower_limit = np.exp(
-        #     (-1) * ((criteria.Epotential_avg + criteria.Epotential_std*1.8) / inputs.NumAtoms) / beta)
-        Prob_lower_limit = np.exp(
-            (-1) * ((criteria.Epotential_avg - criteria.Epotential_std*2.0) / inputs.NumAtoms) / beta)
-
-        # Get relative probability of the canomical ensemble
-        criteria_Prob_inter = Prob / Prob_upper_limit;
-        criteria_Prob = criteria_Prob_inter ** (
-            np.log(0.2) / np.log(Prob_lower_limit / Prob_upper_limit)
-            )
-        # It can go beyond 1, adjust the value.
-        if criteria_Prob > 1: criteria_Prob = 1;
-        sys.stdout.flush()
+        # Caculate the canonical ensemble propbability using the total energy;
+        # it is 1 at the upper limit (avg + std) and 0.2 at the lower limit (avg - 2*std).
+        # The Boltzmann factors exp(-E/(NumAtoms*kB*T)) cancel in the ratios,
+        # leaving 0.2 ** ((upper limit - Epot_step) / (upper limit - lower limit)).
+        criteria_Prob_exponent = (
+            criteria.Epotential_avg + criteria.Epotential_std - Epot_step
+            ) / (3.0 * criteria.Epotential_std)
+        # It can go beyond 1 (non-positive exponent), adjust the value.
+        if criteria_Prob_exponent <= 0:
+            criteria_Prob = 1.0
+        else:
+            criteria_Prob = math.pow(0.2, criteria_Prob_exponent)
 
     # Combine three parts of probabilities
     if inputs.al_type == 'EorFmax':
@@ -558,22 +642,114 @@ def get_criteria_uncert(
         Probability from uncertainty values
     """
     if uncert_type == 'relative':
-        criteria_Uncert = 0.5 * (
-            1 + special.erf(
-                (
-                    (UncertRel - criteria_UncertRel_avg) -
-                    uncert_shift * criteria_UncertRel_std
-                ) / (uncert_grad * criteria_UncertRel_std * np.sqrt(2 * 0.1))
+        criteria_Uncert = _criteria_erf(
+            UncertRel, criteria_UncertRel_avg, criteria_UncertRel_std,
+            uncert_shift, uncert_grad
             )
-        )
     elif uncert_type == 'absolute':
-        criteria_Uncert = 0.5 * (
-            1 + special.erf(
-                (
-                    (UncertAbs - criteria_UncertAbs_avg) -
-                    uncert_shift * criteria_UncertAbs_std
-                ) / (uncert_grad * criteria_UncertAbs_std * np.sqrt(2 * 0.1))
+        criteria_Uncert = _criteria_erf(
+            UncertAbs, criteria_UncertAbs_avg, criteria_UncertAbs_std,
+            uncert_shift, uncert_grad
             )
-        )
 
-    return criteria_Uncert
\ No newline at end of file
+    return criteria_Uncert
+
+
+def get_criteria_uncert_batch(
+    uncert_type, uncert_shift, uncert_grad,
+    UncertAbs, criteria_UncertAbs_avg, criteria_UncertAbs_std,
+    UncertRel, criteria_UncertRel_avg, criteria_UncertRel_std
+):
+    """Function [get_criteria_uncert_batch]
+    Calculate probabilities of many MD steps at once
+    in the same way as get_criteria_uncert
+
+    Parameters:
+
+    uncert_type: str
+        Type of uncertainty; 'absolute', 'relative'
+    uncert_shift: float
+        Shifting of erf function
+        (Value is relative to standard deviation)
+    uncert_grad: float
+        Gradient of erf function
+        (Value is relative to standard deviation)
+    UncertAbs: np.array of float
+        Absolute uncertainties of MD steps
+    criteria_UncertAbs_avg: float
+        Average of absolute uncertainty
+    criteria_UncertAbs_std: float
+        Standard deviation of absolute uncertainty
+
+    UncertRel: np.array of float
+        Relative uncertainties of MD steps
+    criteria_UncertRel_avg: float
+        Average of relative uncertainty
+    criteria_UncertRel_std: float
+        Standard deviation of relative uncertainty
+
+    Returns:
+
+    criteria_Uncert: np.array of float
+        Probabilities from uncertainty values
+    """
+    if uncert_type == 'relative':
+        criteria_Uncert = _criteria_erf_batch(
+            np.asarray(UncertRel, dtype=np.float64),
+            criteria_UncertRel_avg, criteria_UncertRel_std,
+            uncert_shift, uncert_grad
+            )
+    elif uncert_type == 'absolute':
+        criteria_Uncert = _criteria_erf_batch(
+            np.asarray(UncertAbs, dtype=np.float64),
+            criteria_UncertAbs_avg, criteria_UncertAbs_std,
+            uncert_shift, uncert_grad
+            )
+
+    return criteria_Uncert
+
+
+@njit(cache=True, error_model='numpy')
+def _criteria_erf_batch(uncert, uncert_avg, uncert_std, uncert_shift, uncert_grad):
+    """Function [_criteria_erf_batch]
+    Apply _criteria_erf to each uncertainty of an array.
+    """
+    criteria_Uncert = np.empty(uncert.shape[0])
+    for i in range(uncert.shape[0]):
+        criteria_Uncert[i] = _criteria_erf(
+            uncert[i], uncert_avg, uncert_std, uncert_shift, uncert_grad
+            )
+    return criteria_Uncert
+
+
+@njit(cache=True, error_model='numpy')
+def _criteria_erf(uncert, uncert_avg, uncert_std, uncert_shift, uncert_grad):
+    """Function [_criteria_erf]
+    Evaluate the cumulative distribution function of an uncertainty.
+
+    Parameters:
+
+    uncert: float
+        Uncertainty at current step
+    uncert_avg: float
+        Average of uncertainty
+    uncert_std: float
+        Standard deviation of uncertainty
+    uncert_shift: float
+        Shifting of erf function
+        (Value is relative to standard deviation)
+    uncert_grad: float
+        Gradient of erf function
+        (Value is relative to standard deviation)
+
+    Returns:
+
+    criteria_Uncert: float
+        Probability from uncertainty values
+    """
+    return 0.5 * (
+        1 + math.erf(
+            ((uncert - uncert_avg) - uncert_shift * uncert_std)
+            / (uncert_grad * uncert_std * _SQRT_02)
+        )
+    )
@@ -158,6 +158,13 @@ class inputs:
         # friction: float
         #     Strength of the friction parameter in NVTLangevin ensemble
         self.friction = 0.02
+        # integrator_backend: str
+        #     Backend of the Langevin integrator in NVTLangevin_temp; 'numba', 'numpy'
+        #     (the uncertainty criteria always use the numba kernels)
+        self.integrator_backend = 'numba'
+        # uncert_dtype: str
+        #     Precision of the force uncertainty reduction in NVTLangevin_temp; 'fp64', 'fp32'
+        self.uncert_dtype = 'fp64'
 
         ##[NPTBerendsen setting]
         # taut: float
@@ -1,12 +1,9 @@
-from ase.io.trajectory import Trajectory
-
 import os
-import numpy as np
-import pandas as pd
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 from libs.lib_util        import check_mkdir, single_print, generate_msg
-from libs.lib_criteria    import get_result
-from libs.lib_termination import get_testerror
 
 
 def check_progress(inputs, calc_step='cont'):
@@ -56,21 +53,28 @@ def check_progress(inputs, calc_step='cont'):
         Type of sampling; 'active' (active learning), 'random'
     """
 
+    from libs.lib_criteria    import get_result
+    from libs.lib_termination import get_testerror
+
     # Initialization
     MD_index = 0
     MD_step_index = 0
     signal = 0
+
+    # Header of 'result.txt' and its contents (read once)
+    result_msg = generate_msg(inputs.al_type)
+    # The last column is filled at the end of each iteration
+    result_col = result_msg.rsplit('\t', 1)[-1]
+    if os.path.exists('result.txt'):
+        result_data = _read_tsv('result.txt')
+    else:
+        result_data = None
     
     if inputs.index == 0: # When calculation is just initiated
         # When there is no 'result.txt'
-        if not os.path.exists('result.txt'):
+        if result_data is None:
             # Open a recording 'result.txt' file
-            outputfile = open('result.txt', 'w')
-
-            result_msg = generate_msg(inputs.al_type)
-
-            outputfile.write(result_msg + '\n')
-            outputfile.close()
+            _write_result_header(result_msg)
             # Get the test errors using data-tst.npz
             import random
             inputs.idx_atom = random.randint(0, inputs.NumAtoms)
@@ -78,15 +82,7 @@ def check_progress(inputs, calc_step='cont'):
             get_testerror(inputs)
         else: # When there is a 'result.txt',
             # Check the contents in 'result.txt' before recording
-            if os.path.exists('result.txt'):
-
-                result_msg = generate_msg(inputs.al_type)
-
-                result_data = \
-                pd.read_csv('result.txt', index_col=False, delimiter='\t')
-                get_criteria_index = len(result_data.loc[:,result_msg[-14:]]);
-            else:
-                get_criteria_index = -1
+            get_criteria_index = len(result_data.loc[:,result_col]);
 
             # Print the test errors only for first calculation
             if get_criteria_index == 0:
@@ -96,16 +92,15 @@ def check_progress(inputs, calc_step='cont'):
                 single_print(f'[cont]\tRandomly selected biased idx_atom : {inputs.idx_atom}')
                 get_testerror(inputs)
     else:
-        result_data = \
-        pd.read_csv('result.txt', index_col=False, delimiter='\t')
-        get_criteria_index = np.array(result_data.loc[:,'Iteration'])[-1]
+        if result_data is None:
+            result_data = _read_tsv('result.txt')
+        get_criteria_index = result_data['Iteration'].to_numpy()[-1]
         if inputs.index == (get_criteria_index if calc_step == 'gen' else get_criteria_index + 1):
             import random
             inputs.idx_atom = random.randint(0, inputs.NumAtoms)
             single_print(f'[cont]\tRandomly selected biased idx_atom : {inputs.idx_atom}')
             get_testerror(inputs)
-        result_msg = generate_msg(inputs.al_type)
-        get_criteria_index = result_data.loc[:,result_msg[-14:]].isnull().values.any();
+        get_criteria_index = _has_nan(result_data, result_col)
         if get_criteria_index:
             # Get the test errors using data-test.npz
             get_result(inputs, 'progress')
@@ -118,39 +113,23 @@ def check_progress(inputs, calc_step='cont'):
         # Check the existence of uncertainty file
         if os.path.exists(f'./{uncert_file}'):
             single_print(f'\t[prog]\tFound {uncert_file}')
-            uncert_data = pd.read_csv(uncert_file,\
-                                      index_col=False, delimiter='\t')
+            uncert_check, uncert_len = _last_counting_and_len(uncert_file)
 
-            if len(uncert_data) == 0: # If it is empty,
+            if uncert_len == 0: # If it is empty,
                 single_print(f'\t[prog]\t{uncert_file} is empty. So, create it.')
-                check_mkdir('UNCERT')
-                trajfile = open(uncert_file, 'w')
-                title = 'Temperature[K]\t'
-                if inputs.ensemble[:3] == 'NPT':
-                    title += 'Pressure[GPa]\t'
-                title += 'UncertAbs_E\tUncertRel_E\tUncertAbs_F\tUncertRel_F'\
-                        +'\tUncertAbs_S\tUncertRel_S\tEpot_average\tS_average'\
-                        +'\tCounting\tProbability\tAcceptance\n'
-                trajfile.write(title)
-                trajfile.close()
+                _write_uncert_header(uncert_file, inputs.ensemble)
                 break
             else: # If it is not empty,
                 single_print(f'\t[prog]\tRead {uncert_file}')
                 # Check the last entry in the 'Couting' column
-                uncert_check = np.array(uncert_data.loc[:,'Counting'])[-1]
-                MD_step_index = len(uncert_data.loc[:, 'Counting'])
-                del uncert_data
+                MD_step_index = uncert_len
 
                 # If it reaches total number of the sampling data
                 if uncert_check >= inputs.ntotal and (MD_step_index >= inputs.nperiod if inputs.calc_type == 'period' or calc_step == 'gen' else True):
 
                     single_print(f'\t[prog]\tThe calculation of {uncert_file} is done')
-                    if os.path.exists('result.txt'):
-                        result_msg = generate_msg(inputs.al_type)
-
-                        result_data = \
-                        pd.read_csv('result.txt', index_col=False, delimiter='\t')
-                        get_criteria_index = result_data.loc[:,result_msg[-14:]].isnull().values.any();
+                    if result_data is not None:
+                        get_criteria_index = _has_nan(result_data, result_col)
 
                     single_print(f'\t[prog]\tWrite uncertainty results of {uncert_file} into result.txt')
                     # Print the test errors
@@ -159,24 +138,22 @@ def check_progress(inputs, calc_step='cont'):
                         # get_result(inputs, 'progress')
                     
                     # Check the FHI-vibes calculations
-                    aims_check = ['Have a nice day.' in open(f'CALC/{inputs.temperature}K-{inputs.pressure}bar_{inputs.index+1}/{jndex}/aims/calculations/aims.out').read()\
-                                   if os.path.exists(f'CALC/{inputs.temperature}K-{inputs.pressure}bar_{inputs.index+1}/{jndex}/aims/calculations/aims.out') else False for jndex in range(inputs.ntotal)];
-                    if False in aims_check:
+                    aims_check = _dft_done(inputs, inputs.index+1)
+                    if not aims_check:
                         single_print(f'\t[prog]\tDFT calculations have not been finished')
                     else:
                         single_print(f'\t[prog]\tDFT calculations are done')
 
-                    if all(aims_check) == True: # If all FHI-vibes calcs are finished,
-                        gen_check = [
-                        os.path.exists(f'MODEL/{inputs.temperature}K-{inputs.pressure}bar_{inputs.index+1}/deployed-model_{index_nmodel}_{index_nstep}.pth')
-                        for index_nmodel in range(inputs.nmodel) for index_nstep in range(inputs.nstep)
-                        ]
+                    if aims_check: # If all FHI-vibes calcs are finished,
+                        gen_check = _models_done(inputs, inputs.index+1)
                         MD_step_index = 0
 
-                        if all(gen_check) == True:
+                        if gen_check:
                             # Get the test errors using data-test.npz
+                            # (unless a previous run already recorded them)
                             inputs.index += 1
-                            get_testerror(inputs)
+                            if _need_testerror(inputs):
+                                get_testerror(inputs)
                         else:
                             inputs.index += 1
                             break
@@ -191,16 +168,7 @@ def check_progress(inputs, calc_step='cont'):
                     break
         else: # If there is no uncertainty file, create it
             single_print(f'\t[prog]\tCannot found {uncert_file}',)
-            check_mkdir('UNCERT')
-            trajfile = open(uncert_file, 'w')
-            title = 'Temperature[K]\t'
-            if inputs.ensemble[:3] == 'NPT':
-                title += 'Pressure[GPa]\t'
-            title += 'UncertAbs_E\tUncertRel_E\tUncertAbs_F\tUncertRel_F'\
-                    +'\tUncertAbs_S\tUncertRel_S\tEpot_average\tS_average'\
-                    +'\tCounting\tProbability\tAcceptance\n'
-            trajfile.write(title)
-            trajfile.close()
+            _write_uncert_header(uncert_file, inputs.ensemble)
             break
             
     return MD_index, MD_step_index, inputs.index, signal
@@ -253,6 +221,8 @@ def check_progress_rand(inputs, calc_step='cont'):
         Type of sampling; 'active' (active learning), 'random'
     """
 
+    from libs.lib_termination import get_testerror
+
     # Initialization
     MD_index = 0
     signal = 0
@@ -261,19 +231,16 @@ def check_progress_rand(inputs, calc_step='cont'):
         # When there is no 'result.txt'
         if not os.path.exists('result.txt'):
             # Open a recording 'result.txt' file
-            outputfile = open('result.txt', 'w')
-            outputfile.write(
+            _write_result_header(
                 'Temperature[K]\tIteration\t'
-                + 'TestError_E\tTestError_F\tTestError_S\n'
+                + 'TestError_E\tTestError_F\tTestError_S'
             )
-            outputfile.close()
             # Get the test errors using data-test.npz
             get_testerror(inputs)
         else: # When there is a 'result.txt',
             # Check the contents in 'result.txt' before recording
             if os.path.exists('result.txt'):
-                result_data = \
-                pd.read_csv('result.txt', index_col=False, delimiter='\t')
+                result_data = _read_tsv('result.txt')
                 inputs.index = len(result_data.loc[:,'Iteration']);
             else:
                 inputs.index = -1
@@ -283,31 +250,283 @@ def check_progress_rand(inputs, calc_step='cont'):
             # Get the test errors using data-test.npz
             get_testerror(inputs)
 
-    # Go through the while loop until a breaking command
-    while True:
-        # Check the FHI-vibes calculations
-        aims_check = ['Have a nice day.' in open(f'CALC/{inputs.temperature}K-{inputs.pressure}bar_{inputs.index+1}/{jndex}/aims/calculations/aims.out').read()\
-                       if os.path.exists(f'CALC/{inputs.temperature}K-{inputs.pressure}bar_{inputs.index+1}/{jndex}/aims/calculations/aims.out') else False for jndex in range(inputs.ntotal)];
-        
-        if all(aims_check) == True: # If all FHI-vibes calcs are finished,
-            gen_check = [
-            os.path.exists(f'MODEL/{inputs.temperature}K-{inputs.pressure}bar_{inputs.index+1}/deployed-model_{index_nmodel}_{index_nstep}.pth')
-            for index_nmodel in range(inputs.nmodel) for index_nstep in range(inputs.nstep)
-            ]
-
-            if all(gen_check) == True:
-                # Get the test errors using data-test.npz
-                inputs.index += 1
-                get_testerror(inputs)
-            else:
-                inputs.index += 1
-                break
-        else:
+    # Move forward over the iterations whose DFT calculations are finished;
+    # stop after the first one without all trained models
+    while _dft_done(inputs, inputs.index+1):
+        gen_check = _models_done(inputs, inputs.index+1)
+        inputs.index += 1
+        if not gen_check:
             break
+        # Get the test errors using data-test.npz
+        # (unless a previous run already recorded them)
+        if _need_testerror(inputs):
+            get_testerror(inputs)
+
     return MD_index, inputs.index, signal
 
 
 
+def _need_testerror(inputs):
+    """Function [_need_testerror]
+    Check whether the test errors of the current iteration
+    still have to be recorded in 'result.txt'.
+
+    Parameters:
+
+    inputs.index: int
+        The index of AL interactive step
+
+    Returns:
+
+    need: bool
+        False if 'result.txt' already has a row for inputs.index
+    """
+    if not os.path.exists('result.txt'):
+        return True
+    iterations = _read_tsv('result.txt')['Iteration'].to_numpy()
+    return not (iterations == inputs.index).any()
+
+
+def _write_result_header(result_msg):
+    """Function [_write_result_header]
+    Create 'result.txt' with its header line.
+
+    Parameters:
+
+    result_msg: str
+        The header line without the line break
+    """
+    with open('result.txt', 'w') as outputfile:
+        outputfile.write(result_msg + '\n')
+
+
+def _write_uncert_header(uncert_file, ensemble):
+    """Function [_write_uncert_header]
+    Create an uncertainty file with its header line.
+
+    Parameters:
+
+    uncert_file: str
+        A path to the uncertainty file in 'UNCERT'
+    ensemble: str
+        Type of MD ensembles; a pressure column is added for NPT ensembles
+    """
+    check_mkdir('UNCERT')
+    title = 'Temperature[K]\t'
+    if ensemble[:3] == 'NPT':
+        title += 'Pressure[GPa]\t'
+    title += 'UncertAbs_E\tUncertRel_E\tUncertAbs_F\tUncertRel_F'\
+            +'\tUncertAbs_S\tUncertRel_S\tEpot_average\tS_average'\
+            +'\tCounting\tProbability\tAcceptance\n'
+    with open(uncert_file, 'w') as trajfile:
+        trajfile.write(title)
+
+
+def _read_tsv(path):
+    """Function [_read_tsv]
+    Read a tab-separated result file into a pandas DataFrame.
+
+    Parameters:
+
+    path: str
+        A path to the tab-separated file
+
+    Returns:
+
+    data: pandas DataFrame
+        Contents of the file
+    """
+    import pandas as pd
+
+    # The C engine tolerates the partial last row written by get_testerror,
+    # and treats missing values as lib_criteria.read_columns does
+    return pd.read_csv(path, index_col=False, delimiter='\t', engine='c')
+
+
+def _has_nan(result_data, column):
+    """Function [_has_nan]
+    Check whether a column of the recorded results has missing values.
+
+    Parameters:
+
+    result_data: pandas DataFrame
+        Contents of 'result.txt'
+    column: str
+        The name of the column
+
+    Returns:
+
+    missing: bool
+        True if any value is missing
+    """
+    import numpy as np
+    import pandas as pd
+
+    values = result_data[column].to_numpy()
+    if values.dtype.kind == 'f':
+        return bool(np.isnan(values).any())
+    return bool(pd.isna(values).any())
+
+
+def _dft_done(inputs, index):
+    """Function [_dft_done]
+    Check whether all FHI-vibes calculations of an iteration are finished.
+    Output files are checked concurrently
+    once all calculation directories exist.
+
+    Parameters:
+
+    inputs: class
+        Input parameters (temperature, pressure, ntotal)
+    index: int
+        The index of the iteration in CALC
+
+    Returns:
+
+    done: bool
+        True if all calculations are finished
+    """
+    calc_path = f'CALC/{inputs.temperature}K-{inputs.pressure}bar_{index}'
+    calc_dirs = _listdir_set(calc_path)
+    if not all(str(jndex) in calc_dirs for jndex in range(inputs.ntotal)):
+        return False
+    if inputs.ntotal == 0:
+        return True
+
+    # Overlap the latency of reading many files on a networked file system
+    aims_prefix = calc_path + '/'
+    aims_suffix = '/aims/calculations/aims.out'
+    aims_paths = [aims_prefix + str(jndex) + aims_suffix for jndex in range(inputs.ntotal)]
+    with ThreadPoolExecutor(max_workers=min(16, inputs.ntotal)) as executor:
+        return all(executor.map(_aims_done, aims_paths))
+
+
+def _models_done(inputs, index):
+    """Function [_models_done]
+    Check whether all trained models of an iteration are deployed.
+
+    Parameters:
+
+    inputs: class
+        Input parameters (temperature, pressure, nmodel, nstep)
+    index: int
+        The index of the iteration in MODEL
+
+    Returns:
+
+    done: bool
+        True if all deployed models exist
+    """
+    model_files = _listdir_set(f'MODEL/{inputs.temperature}K-{inputs.pressure}bar_{index}')
+    return model_files.issuperset(_model_names(inputs.nmodel, inputs.nstep))
+
+
+@lru_cache(maxsize=8)
+def _model_names(nmodel, nstep):
+    """Function [_model_names]
+    Get the file names of all deployed models (computed once per ensemble size).
+
+    Parameters:
+
+    nmodel: int
+        The number of ensemble model sets with different initialization
+    nstep: int
+        The number of subsampling sets
+
+    Returns:
+
+    model_names: frozenset of str
+        File names of the deployed models
+    """
+    return frozenset(
+        f'deployed-model_{index_nmodel}_{index_nstep}.pth'
+        for index_nmodel in range(nmodel) for index_nstep in range(nstep)
+        )
+
+
+def _last_counting_and_len(path):
+    """Function [_last_counting_and_len]
+    Read the last entry of the 'Counting' column
+    and the number of recorded MD steps in an uncertainty file.
+
+    Parameters:
+
+    path: str
+        A path to the uncertainty file
+
+    Returns:
+
+    counting: float or None
+        The last entry of the 'Counting' column (None if empty)
+    nlines: int
+        The number of recorded MD steps
+    """
+    with open(path) as uncert_file:
+        header = [title.strip() for title in uncert_file.readline().split('\t')]
+        column = header.index('Counting')
+
+        counting, nlines = None, 0
+        for line in uncert_file:
+            if line.strip():
+                last_line = line
+                nlines += 1
+
+    if nlines > 0:
+        counting = float(last_line.split('\t')[column])
+
+    return counting, nlines
+
+
+def _aims_done(path, tail_size=4096):
+    """Function [_aims_done]
+    Check whether an FHI-aims calculation is finished
+    by scanning only the end of its output file.
+
+    Parameters:
+
+    path: str
+        A path to aims.out
+    tail_size: int (optional)
+        The number of bytes searched from the end of the file
+
+    Returns:
+
+    done: bool
+        True if 'Have a nice day.' is found
+        (False if the file does not exist)
+    """
+    try:
+        with open(path, 'rb') as aims_out:
+            size = os.fstat(aims_out.fileno()).st_size
+            if size <= tail_size:
+                return b'Have a nice day.' in aims_out.read()
+            # Search the tail of a large file in place without copying it
+            with mmap.mmap(aims_out.fileno(), 0, access=mmap.ACCESS_READ) as aims_map:
+                return aims_map.rfind(b'Have a nice day.', size - tail_size) != -1
+    except FileNotFoundError:
+        return False
+
+
+def _listdir_set(path):
+    """Function [_listdir_set]
+    List the names in a directory with a single system call.
+
+    Parameters:
+
+    path: str
+        A path to the directory
+
+    Returns:
+
+    names: set of str
+        Names of files and directories (empty if the directory does not exist)
+    """
+    try:
+        return set(os.listdir(path))
+    except FileNotFoundError:
+        return set()
+
+
 def check_index(inputs, calc_step='cont'):
     """Function [check_index]
     Check the progress of previous calculations
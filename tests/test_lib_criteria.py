@@ -0,0 +1,19 @@
+import numpy as np
+
+from libs.lib_criteria import read_columns
+
+
+def test_read_columns_partial_last_row(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    header = ['Temperature', 'Pressure', 'Iteration', 'TestError_E', 'TestError_F', 'UncertAbs_E', 'UncertAbs_F']
+    with open('result.txt', 'w') as f:
+        f.write('\t'.join(header) + '\n')
+        f.write('300\t0\t0\t0.1\t0.2\t0.3\t0.4\n')
+        # get_testerror writes the first part of a row; get_result completes it later
+        f.write('300\t0\t1\t0.5\t0.6')
+
+    data = read_columns('result.txt', ['TestError_E', 'UncertAbs_F'])
+
+    np.testing.assert_allclose(data['TestError_E'], [0.1, 0.5])
+    assert data['UncertAbs_F'][0] == 0.4
+    assert np.isnan(data['UncertAbs_F'][1])